@@ -5,8 +5,10 @@ from dotenv import load_dotenv
 import os
 import random
 import json
+import re
 from predict import (
     load_symptom_data,
+    build_disease_profiles,
     extract_symptoms_from_text,
     predict_disease_percent
 )
@@ -16,7 +18,7 @@ from health_prompt_template import (
     get_ai3_doctor_reply_template,
     get_skin_image_summary_template,
 )
-from skin_model_predict import predict_skin_disease
+from skin_model_predict import ABNORMAL_CLASS, NORMAL_CLASS, predict_skin_disease, preload_skin_model
 import warnings
 from PIL import Image
 
@@ -28,19 +30,73 @@ load_dotenv()
 TYPHOON_API_KEY = os.getenv("TYPHOON_API_KEY")
 TYPHOON_API_URL = "https://api.opentyphoon.ai/v1"
 
-client = OpenAI(
-    api_key=TYPHOON_API_KEY,
-    base_url=TYPHOON_API_URL
-)
+TYPHOON_MODEL = "typhoon-v2.1-12b-instruct"
+TYPHOON_TIMEOUT = 30.0  # วินาทีต่อคำขอ
+TYPHOON_MAX_RETRIES = 2
+
+# พารามิเตอร์ LLM ของแต่ละขั้นเป็นค่าคงที่ สร้างครั้งเดียวไม่ต้องสร้าง dict ใหม่ทุกคำขอ
+AI1_LLM_PARAMS = {"model": TYPHOON_MODEL, "temperature": 0.2, "max_new_tokens": 256}
+AI2_LLM_PARAMS = {"model": TYPHOON_MODEL, "temperature": 0.2, "max_new_tokens": 512}
+DOCTOR_LLM_PARAMS = {"model": TYPHOON_MODEL, "temperature": 0.2, "max_new_tokens": 512}
+DISEASE_INFO_LLM_PARAMS = {"model": TYPHOON_MODEL, "temperature": 0.3, "max_new_tokens": 512}
+
+# ความมั่นใจของโมเดลภาพที่ต่ำกว่านี้ตอบด้วยข้อความสรุปในเครื่อง ไม่เรียก LLM
+SKIN_LLM_CONFIDENCE_FLOOR = float(os.getenv("SKIN_LLM_CONFIDENCE_FLOOR", "0.6"))
 
 SYMPTOM_CSV = "./data/full_onehot_disease.csv"
-df, known_symptoms, disease_col = load_symptom_data(SYMPTOM_CSV)
-known_diseases = list(df[disease_col].unique())  # สำหรับตรวจชื่อโรค
+SYMPTOM_JSON = "./symptoms_data.json"
+
+# Streamlit รันสคริปต์ใหม่ทุกครั้งที่มีการโต้ตอบ จึงใช้ cache_resource
+# เพื่อโหลด client / ข้อมูลอาการ / Guardrails เพียงครั้งเดียวต่อ process
+@st.cache_resource(show_spinner=False)
+def get_typhoon_client():
+    # client ตัวเดียวใช้ connection pool (keep-alive) ร่วมกันทุกคำขอ ไม่ต้องเปิด TLS ใหม่ทุกครั้ง
+    return OpenAI(
+        api_key=TYPHOON_API_KEY,
+        base_url=TYPHOON_API_URL,
+        timeout=TYPHOON_TIMEOUT,
+        max_retries=TYPHOON_MAX_RETRIES
+    )
+
+def compile_word_pattern(words):
+    # รวมคำทั้งกลุ่มเป็น regex เดียว เพื่อสแกนข้อความครั้งเดียวแทนการวนเช็กทีละคำ
+    return re.compile("|".join(re.escape(word) for word in sorted(words, key=len, reverse=True)))
+
+def compile_disease_pattern(diseases):
+    # ชื่อโรค (ภาษาอังกฤษ) ต้องเป็นคำเต็ม ไม่ตรงกับส่วนหนึ่งของคำอื่น (เช่น 'aids' ใน 'braids')
+    # ขอบคำดูเฉพาะตัวอักษรละติน/ตัวเลข ชื่อโรคที่พิมพ์ติดกับข้อความภาษาไทยจึงยังตรวจพบ
+    # ชื่อที่เป็นตัวพิมพ์ใหญ่ทั้งหมด (ตัวย่อ เช่น AIDS, GERD) ต้องตรงตัวพิมพ์ ไม่ให้ 'hearing aids' ถูกนับเป็นโรค
+    # ชื่ออื่นจับคู่แบบไม่สนตัวพิมพ์
+    alternatives = (
+        re.escape(disease) if disease.isupper() else f"(?i:{re.escape(disease)})"
+        for disease in sorted(diseases, key=len, reverse=True)
+    )
+    return re.compile(r"(?<![A-Za-z0-9])(?:" + "|".join(alternatives) + r")(?![A-Za-z0-9])")
+
+@st.cache_resource(show_spinner=False)
+def load_symptom_resources(csv_path):
+    df, known_symptoms, disease_col = load_symptom_data(csv_path)
+    # สำหรับตรวจชื่อโรค: ข้อความที่ตรงกับ pattern แปลงเป็นตัวพิมพ์เล็กแล้วหาชื่อโรคตามข้อมูลจาก dict
+    known_diseases = df[disease_col].unique()
+    disease_by_lower = {disease.lower(): disease for disease in known_diseases}
+    disease_pattern = compile_disease_pattern(known_diseases)
+    profiles = build_disease_profiles(df, disease_col, known_symptoms)
+    return df, known_symptoms, disease_col, disease_by_lower, disease_pattern, profiles
 
 # ===== Guardrails หลายไฟล์ สำหรับแต่ละ AI
-guard_ai1 = Guard.from_rail("guardrails_spec_ai1.rail")
-guard_ai2 = Guard.from_rail("guardrails_spec_ai2.rail")
-guard = Guard.from_rail("guardrails_spec.rail")
+@st.cache_resource(show_spinner=False)
+def load_guards():
+    guard_ai1 = Guard.from_rail("guardrails_spec_ai1.rail")
+    guard_ai2 = Guard.from_rail("guardrails_spec_ai2.rail")
+    guard = Guard.from_rail("guardrails_spec.rail")
+    return guard_ai1, guard_ai2, guard
+
+client = get_typhoon_client()
+(df, known_symptoms, disease_col,
+ KNOWN_DISEASE_BY_LOWER, KNOWN_DISEASE_PATTERN, profiles) = load_symptom_resources(SYMPTOM_CSV)
+guard_ai1, guard_ai2, guard = load_guards()
+# โหลดโมเดลภาพผิวหนังเบื้องหลังตั้งแต่เปิดแอป (เฉพาะเมื่อตั้ง SKIN_MODEL_PRELOAD=1) ไม่ให้ผู้ใช้คนแรกที่กดวิเคราะห์ต้องรอ
+preload_skin_model()
 
 # =========================
 # กลุ่มคำสนทนาทั่วไป
@@ -68,6 +124,30 @@ HOW_ARE_YOU_REPLIES = [
     "ขอบคุณที่ทักมาถามนะคะ มีอะไรอยากปรึกษาเกี่ยวกับสุขภาพไหมคะ"
 ]
 
+# สคริปต์ถูกรันใหม่ทุกครั้งที่มีการโต้ตอบ จึงคอมไพล์ pattern ใน cache_resource ครั้งเดียวต่อ process
+@st.cache_resource(show_spinner=False)
+def load_keyword_patterns():
+    return (
+        compile_word_pattern(THANK_WORDS),
+        compile_word_pattern(GENERAL_GREET_WORDS),
+        compile_word_pattern(HOW_ARE_YOU_WORDS),
+    )
+
+THANK_PATTERN, GENERAL_GREET_PATTERN, HOW_ARE_YOU_PATTERN = load_keyword_patterns()
+
+# ผลที่ memoize ในสคริปต์นี้ใช้ st.cache_data ซึ่งคงอยู่ตลอด process
+# (lru_cache ในสคริปต์หลักจะถูกสร้างใหม่ว่างเปล่าทุกครั้งที่ Streamlit รันสคริปต์ซ้ำ)
+@st.cache_data(max_entries=512, show_spinner=False)
+def extract_symptoms_cached(user_message):
+    # ข้อความเดิม (เช่น ผู้ใช้ส่งซ้ำ) ได้อาการชุดเดิมเสมอ เก็บผล fuzzy match ไว้ใช้ซ้ำข้ามการรันสคริปต์
+    return extract_symptoms_from_text(user_message, known_symptoms)
+
+# df/profiles มาจาก load_symptom_resources ซึ่งเหมือนเดิมตลอด process จึงไม่ต้องเป็นส่วนของ key
+@st.cache_data(max_entries=256, show_spinner=False)
+def predict_diseases_cached(symptoms, top_n):
+    # ผลทำนายไม่ขึ้นกับลำดับอาการ ผู้เรียกส่ง tuple ที่เรียงแล้วเป็น key ให้อาการชุดเดิมได้ผลจาก cache
+    return predict_disease_percent(symptoms, df, disease_col, top_n=top_n, profiles=profiles)
+
 def load_json_file(file_path):
     with open(file_path, "r", encoding="utf-8") as file:
         return json.load(file)
@@ -76,45 +156,55 @@ def convert_json_to_str(json_data):
     # ใช้ json.dumps() เพื่อแปลงข้อมูลทุกอย่างใน JSON เป็น string
     return json.dumps(json_data, ensure_ascii=False)
 
+@st.cache_resource(show_spinner=False)
+def load_symptom_reference(json_file_path):
+    # ไฟล์อ้างอิงอาการไม่เปลี่ยนระหว่างรัน แปลงเป็น string ครั้งเดียวแล้วใช้ซ้ำ
+    return convert_json_to_str(load_json_file(json_file_path))
+
+# ขึ้นบรรทัดใหม่ที่บรรทัดก่อนหน้ามีข้อความ และบรรทัดถัดไปขึ้นต้นด้วย bullet (•)
+BULLET_BREAK_PATTERN = re.compile(r"(?<=\S)([^\S\n]*)\n(?=[^\S\n]*•)")
+
 def format_ai3_bullet(text):
-    lines = text.split('\n')
-    new_lines = []
-    for i, line in enumerate(lines):
-        if line.strip().startswith('•'):
-            if i > 0 and lines[i-1].strip() != '':
-                new_lines.append('')  # เพิ่มบรรทัดว่างระหว่าง bullet
-        new_lines.append(line)
-    return '\n'.join(new_lines)
+    # เพิ่มบรรทัดว่างระหว่าง bullet ด้วย regex sub ครั้งเดียว แทนการ split แล้ววนทีละบรรทัด
+    return BULLET_BREAK_PATTERN.sub(r"\1\n\n", text)
 
 # =========================
+# system message เหมือนกันทุกคำขอ สร้าง dict ครั้งเดียวแล้วใช้ซ้ำ
+TYPHOON_SYSTEM_MESSAGE = {"role": "system", "content": "คุณเป็นผู้ช่วย AI สุขภาพเบื้องต้น พูดจาอ่อนโยน ให้ข้อมูลเหมือนผู้หญิงไทย สุภาพ เป็นมิตร ไม่พูด 'สวัสดี' ทุกครั้ง (พูดแค่ทักทายครั้งแรกเท่านั้น) และห้ามวินิจฉัยหรือสั่งยา ต้องแนะนำให้พบแพทย์เสมอ"}
+
 def typhoon_wrapper(prompt, **kwargs):
-    model = kwargs.get("model", "typhoon-v2.1-12b-instruct")
+    model = kwargs.get("model", TYPHOON_MODEL)
     temperature = kwargs.get("temperature", 0.3)
     max_tokens = kwargs.get("max_new_tokens", 512)
     response = client.chat.completions.create(
         model=model,
-        messages=[{"role": "system", "content": "คุณเป็นผู้ช่วย AI สุขภาพเบื้องต้น พูดจาอ่อนโยน ให้ข้อมูลเหมือนผู้หญิงไทย สุภาพ เป็นมิตร ไม่พูด 'สวัสดี' ทุกครั้ง (พูดแค่ทักทายครั้งแรกเท่านั้น) และห้ามวินิจฉัยหรือสั่งยา ต้องแนะนำให้พบแพทย์เสมอ"},
-                  {"role": "user", "content": prompt}],
+        messages=[TYPHOON_SYSTEM_MESSAGE, {"role": "user", "content": prompt}],
         max_tokens=max_tokens,
         temperature=temperature
     )
     return response.choices[0].message.content
 
 # ================= AI 3 CHAIN =================
-def ai_chain_consistency(user_symptoms, predicted_diseases, llm_api, json_file):
-    json_data = json_file
-    disease_info = json_data
-    predicted_diseases_str = "\n".join([f"{i+1}. {d} {p}% (จาก {m} อาการ)" for i, (d, p, m) in enumerate(predicted_diseases)])
+def format_predicted_diseases(predicted_diseases):
+    # แปลงผลทำนายเป็นรายการลำดับเลข ใช้ร่วมกันทั้ง AI1 และ AI2
+    return "\n".join(f"{i}. {d} {p}% (จาก {m} อาการ)" for i, (d, p, m) in enumerate(predicted_diseases, 1))
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def render_consistency_prompt(user_symptoms, predicted_diseases, json_data):
+    # prompt ของ AI1 ขึ้นกับอาการ/ผลทำนาย/ข้อมูล JSON เท่านั้น อาการชุดเดิมจึงได้ prompt เดิมจาก cache
     prompt_template = get_ai1_consistency_template()
-    prompt = prompt_template.format(
+    return prompt_template.format(
         user_symptoms=", ".join(user_symptoms),
-        predicted_diseases=predicted_diseases_str,
-        json_data=disease_info
+        predicted_diseases=format_predicted_diseases(predicted_diseases),
+        json_data=json_data
     )
+
+def ai_chain_consistency(user_symptoms, predicted_diseases, llm_api, json_file):
+    prompt = render_consistency_prompt(user_symptoms, predicted_diseases, json_file)
     response = guard_ai1(
         prompt=prompt,
         llm_api=llm_api,
-        llm_params={"model": "typhoon-v2.1-12b-instruct", "temperature": 0.2, "max_new_tokens": 256}
+        llm_params=AI1_LLM_PARAMS
     )
     return response.validated_output if response.validated_output else {}
 
@@ -122,13 +212,13 @@ def ai_chain_summary(user_symptoms, predicted_diseases, ai1_comment, llm_api):
     prompt_template = get_ai2_summary_template()
     prompt = prompt_template.format(
         user_symptoms=", ".join(user_symptoms),
-        predicted_diseases="\n".join([f"{i+1}. {d} {p}% (จาก {m} อาการ)" for i, (d, p, m) in enumerate(predicted_diseases)]),
+        predicted_diseases=format_predicted_diseases(predicted_diseases),
         ai1_comment=ai1_comment or "-"
     )
     response = guard_ai2(
         prompt=prompt,
         llm_api=llm_api,
-        llm_params={"model": "typhoon-v2.1-12b-instruct", "temperature": 0.2, "max_new_tokens": 512}
+        llm_params=AI2_LLM_PARAMS
     )
     return response.validated_output if response.validated_output else {}
 
@@ -138,25 +228,39 @@ def ai_chain_doctor_reply(ai2_summary, ai2_recommendation, llm_api):
         ai2_summary=ai2_summary or "-",
         ai2_recommendation=ai2_recommendation or "-"
     )
-    response = llm_api(prompt, model="typhoon-v2.1-12b-instruct", temperature=0.2, max_new_tokens=512)
+    response = llm_api(prompt, **DOCTOR_LLM_PARAMS)
     return response
 
 # ================= NEW: AI CHAIN FOR SKIN DISEASE =================
-def ai_chain_skin_summary(image_class, confidence, llm_api):
-    """สร้างสรุปและคำแนะนำเบื้องต้นสำหรับการวิเคราะห์ภาพผิวหนัง"""
-    if image_class == "Abnormal(Ulcer)":
-        ai2_summary = f"จากการวิเคราะห์ภาพ พบลักษณะผิดปกติที่อาจเป็นแผลหรือรอยโรคผิวหนัง (ความมั่นใจ {confidence:.1%})"
-        ai2_recommendation = "ควรปรึกษาแพทย์ผิวหนังเพื่อรับการตรวจและรักษาที่เหมาะสม"
-    else:  # Normal(Healthy skin)
-        ai2_summary = f"จากการวิเคราะห์ภาพ ผิวหนังดูปกติ (ความมั่นใจ {confidence:.1%})"
-        ai2_recommendation = "ควรดูแลรักษาความสะอาดและความชุ่มชื้นของผิวหนังต่อไป"
-    
-    return ai2_summary, ai2_recommendation
+# ข้อความสรุป/คำแนะนำคงที่ของแต่ละคลาส ต่อท้ายเฉพาะความมั่นใจตอนเรียก
+SKIN_CLASS_TEXT = {
+    ABNORMAL_CLASS: (
+        "จากการวิเคราะห์ภาพ พบลักษณะผิดปกติที่อาจเป็นแผลหรือรอยโรคผิวหนัง ",
+        "ควรปรึกษาแพทย์ผิวหนังเพื่อรับการตรวจและรักษาที่เหมาะสม",
+    ),
+    NORMAL_CLASS: (
+        "จากการวิเคราะห์ภาพ ผิวหนังดูปกติ ",
+        "ควรดูแลรักษาความสะอาดและความชุ่มชื้นของผิวหนังต่อไป",
+    ),
+}
 
-def ai_chain_skin_doctor_reply(image_class, confidence, llm_api):
+def ai_chain_skin_summary(image_class, confidence):
+    """สร้างสรุปและคำแนะนำเบื้องต้นสำหรับการวิเคราะห์ภาพผิวหนัง"""
+    # คลาสอื่นนอกจาก Abnormal ใช้ข้อความของ Normal(Healthy skin)
+    summary_prefix, ai2_recommendation = SKIN_CLASS_TEXT.get(image_class, SKIN_CLASS_TEXT[NORMAL_CLASS])
+    return summary_prefix + f"(ความมั่นใจ {confidence:.1%})", ai2_recommendation
+
+# prompt ขึ้นกับคลาสของภาพและความมั่นใจ (แสดงทศนิยม 1 ตำแหน่งของ %) เท่านั้น
+# ผู้เรียกปัดความมั่นใจเป็น 3 ตำแหน่งก่อน ผลที่ได้ prompt เดียวกันจึงใช้คำตอบจาก cache ไม่ต้องเรียก LLM ซ้ำ
+# (_llm_api ขึ้นต้นด้วย _ ให้ st.cache_data ไม่นำมาเป็นส่วนของ key)
+@st.cache_data(max_entries=128, show_spinner=False)
+def ai_chain_skin_doctor_reply(image_class, confidence, _llm_api):
     """สร้างคำตอบจากหมอสำหรับการวิเคราะห์ภาพผิวหนัง"""
-    ai2_summary, ai2_recommendation = ai_chain_skin_summary(image_class, confidence, llm_api)
-    
+    ai2_summary, ai2_recommendation = ai_chain_skin_summary(image_class, confidence)
+    if confidence < SKIN_LLM_CONFIDENCE_FLOOR:
+        # โมเดลไม่มั่นใจ คำตอบจาก LLM ไม่ได้เพิ่มอะไรจากข้อความสรุป จึงตอบเป็น bullet ทันที
+        return f"• {ai2_summary}\n• {ai2_recommendation}"
+
     prompt_template = get_skin_image_summary_template()
     prompt = prompt_template.format(
         image_class=f"{image_class} (ความมั่นใจ {confidence:.1%})",
@@ -164,7 +268,7 @@ def ai_chain_skin_doctor_reply(image_class, confidence, llm_api):
         ai2_recommendation=ai2_recommendation
     )
     
-    response = llm_api(prompt, model="typhoon-v2.1-12b-instruct", temperature=0.2, max_new_tokens=512)
+    response = _llm_api(prompt, **DOCTOR_LLM_PARAMS)
     return response
 
 # =========================
@@ -172,43 +276,43 @@ def ai_chain_skin_doctor_reply(image_class, confidence, llm_api):
 def ask_bot_streamlit(user_message, n_results=1, greeted=False):
     msg_lower = user_message.lower().strip()
 
-    if any(word in msg_lower for word in THANK_WORDS):
+    if THANK_PATTERN.search(msg_lower):
         return random.choice(THANK_REPLIES)
 
-    if any(word in msg_lower for word in HOW_ARE_YOU_WORDS):
+    if HOW_ARE_YOU_PATTERN.search(msg_lower):
         return random.choice(HOW_ARE_YOU_REPLIES)
 
-    for disease in known_diseases:
-        if disease in user_message or disease in msg_lower:
-            prompt = f"ผู้ใช้แจ้งว่าตนเองอาจเป็น '{disease}'. กรุณาให้คำแนะนำเบื้องต้นเกี่ยวกับโรคนี้ (โดยไม่วินิจฉัย ไม่สั่งยา) และเน้นให้พบแพทย์หากไม่แน่ใจอาการ"
-            response = guard(
-                prompt=prompt,
-                llm_api=typhoon_wrapper,
-                llm_params={"model": "typhoon-v2.1-12b-instruct", "temperature": 0.3, "max_new_tokens": 512}
-            )
-            if response.validated_output and isinstance(response.validated_output, dict):
-                answer = response.validated_output.get("answer")
-                if answer:
-                    return answer.strip()
-            return "ขออภัยค่ะ ดิฉันไม่สามารถให้ข้อมูลได้ในขณะนี้ หากมีอาการผิดปกติควรปรึกษาแพทย์นะคะ"
-
-    if not greeted and any(word in msg_lower for word in GENERAL_GREET_WORDS):
+    # ค้นบนข้อความเดิม (ไม่ใช่ msg_lower) เพื่อให้ชื่อตัวย่อตรวจตัวพิมพ์ได้
+    # ถ้ามีหลายชื่อโรค จะได้ชื่อที่อยู่ซ้ายสุดในข้อความ (ชื่อที่ยาวกว่าก่อนเมื่อเริ่มตำแหน่งเดียวกัน) ไม่ใช่โรคแรกตามลำดับในข้อมูล
+    disease_match = KNOWN_DISEASE_PATTERN.search(user_message)
+    if disease_match:
+        disease = KNOWN_DISEASE_BY_LOWER[disease_match.group(0).lower()]
+        prompt = f"ผู้ใช้แจ้งว่าตนเองอาจเป็น '{disease}'. กรุณาให้คำแนะนำเบื้องต้นเกี่ยวกับโรคนี้ (โดยไม่วินิจฉัย ไม่สั่งยา) และเน้นให้พบแพทย์หากไม่แน่ใจอาการ"
+        response = guard(
+            prompt=prompt,
+            llm_api=typhoon_wrapper,
+            llm_params=DISEASE_INFO_LLM_PARAMS
+        )
+        if response.validated_output and isinstance(response.validated_output, dict):
+            answer = response.validated_output.get("answer")
+            if answer:
+                return answer.strip()
+        return "ขออภัยค่ะ ดิฉันไม่สามารถให้ข้อมูลได้ในขณะนี้ หากมีอาการผิดปกติควรปรึกษาแพทย์นะคะ"
+
+    if not greeted and GENERAL_GREET_PATTERN.search(msg_lower):
         return random.choice(GENERAL_GREET_REPLIES)
 
-    if "ยา" in msg_lower or "แนะนำยา" in msg_lower:
+    if "ยา" in msg_lower:  # ครอบคลุม "แนะนำยา" อยู่แล้ว
         return "ขออภัยค่ะ ดิฉันไม่สามารถแนะนำหรือสั่งยาได้ หากมีอาการผิดปกติควรปรึกษาเภสัชกรหรือแพทย์โดยตรงนะคะ"
 
-    matched_symptoms = extract_symptoms_from_text(user_message, known_symptoms)
+    matched_symptoms = extract_symptoms_cached(user_message)
     if not matched_symptoms:
         return "ขออภัยค่ะ ดิฉันไม่เข้าใจอาการที่ระบุ กรุณาพิมพ์อาการให้ชัดเจน เช่น ปวดหัว มีไข้ ไอ หรืออื่นๆ"
 
-    results = predict_disease_percent(matched_symptoms, df, disease_col)
     n_show = 3 if n_results < 1 else n_results
-    results = results[:n_show]
+    results = predict_diseases_cached(tuple(sorted(matched_symptoms)), n_show)
 
-    json_file_path = './symptoms_data.json'
-    json_data = load_json_file(json_file_path)
-    json_data_str = convert_json_to_str(json_data)
+    json_data_str = load_symptom_reference(SYMPTOM_JSON)
     ai1_res = ai_chain_consistency(matched_symptoms, results, typhoon_wrapper, json_data_str)
     ai1_comment = ai1_res.get('comment', '')
 
@@ -327,7 +431,7 @@ if uploaded_file is not None:
                 predicted_class, confidence = predict_skin_disease(image)
                 
                 # สร้างคำตอบจาก AI Doctor
-                skin_ai3_reply = ai_chain_skin_doctor_reply(predicted_class, confidence, typhoon_wrapper)
+                skin_ai3_reply = ai_chain_skin_doctor_reply(predicted_class, round(confidence, 3), typhoon_wrapper)
                 skin_ai3_reply = format_ai3_bullet(skin_ai3_reply)
                 
                 # เก็บผลลัพธ์ใน session state
@@ -349,7 +453,7 @@ if st.session_state.skin_analysis_result:
     result = st.session_state.skin_analysis_result
     
     # แสดงผลการจำแนกประเภท
-    if result["predicted_class"] == "Abnormal(Ulcer)":
+    if result["predicted_class"] == ABNORMAL_CLASS:
         st.sidebar.warning(f"⚠️ **พบความผิดปกติ**")
     else:
         st.sidebar.success(f"✅ **ผิวหนังปกติ**")
@@ -369,7 +473,8 @@ if user_input:
     st.rerun()
 
 if st.session_state.pending_ai:
-    user_message = [msg["content"] for msg in st.session_state.messages if msg["role"] == "user"][-1]
+    # หาข้อความล่าสุดของผู้ใช้จากท้ายประวัติ ไม่ต้องคัดลอกข้อความทั้งหมดเป็น list ใหม่ทุกรอบ
+    user_message = next(msg["content"] for msg in reversed(st.session_state.messages) if msg["role"] == "user")
     bot_reply = ask_bot_streamlit(user_message, n_results=1, greeted=st.session_state.greeted)
     st.session_state.messages.append({"role": "ai", "content": bot_reply})
 
@@ -1,5 +1,13 @@
+from functools import lru_cache
+
 from langchain.prompts import PromptTemplate
 
+# ข้อกำหนดที่ใช้ซ้ำในหลาย template เก็บเป็นค่าคงที่เดียว ให้ข้อความตรงกันทุก prompt
+PRONOUN_RULE = "โปรดตอบผู้ใช้ด้วยสรรพนามว่า 'คุณ' เท่านั้น (ห้ามใช้ 'ลูกค้า', 'ท่าน', หรือสรรพนามอื่น)\n"
+
+# PromptTemplate ไม่เปลี่ยนหลังสร้าง จึง cache ไว้ใช้ซ้ำแทนการ parse template ใหม่ทุกคำขอ
+
+@lru_cache(maxsize=None)
 def get_ai1_consistency_template():
     return PromptTemplate(
         input_variables=["user_symptoms", "predicted_diseases", "json_data"],
@@ -20,6 +28,7 @@ def get_ai1_consistency_template():
         )
     )
 
+@lru_cache(maxsize=None)
 def get_ai2_summary_template():
     return PromptTemplate(
         input_variables=["user_symptoms", "predicted_diseases", "ai1_comment"],
@@ -27,41 +36,42 @@ def get_ai2_summary_template():
             "อาการที่ผู้ใช้แจ้ง: {user_symptoms}\n"
             "ระบบวิเคราะห์ว่าอาจเป็นโรคต่อไปนี้ (เรียงตามเปอร์เซ็นต์):\n{predicted_diseases}\n"
             "ข้อสังเกตจาก AI1: {ai1_comment}\n"
-            "โปรดตอบผู้ใช้ด้วยสรรพนามว่า 'คุณ' เท่านั้น (ห้ามใช้ 'ลูกค้า', 'ท่าน', หรือสรรพนามอื่น)\n"
+            + PRONOUN_RULE +
             "โปรดสรุปผลและให้คำแนะนำเบื้องต้น 'โดยพูดถึงอาการที่ผู้ใช้แจ้งเป็นหลัก' เช่น ถ้าผู้ใช้ระบุว่าปวดหัว ให้พูดถึงวิธีดูแลตัวเองเมื่อปวดหัว (ห้ามพูดกลางๆ ห้ามพูดแต่เรื่องทั่วไป ห้ามวินิจฉัย/ห้ามแนะนำยา)\n"
             "ให้เน้นข้อควรระวังหรืออาการแทรกซ้อนเฉพาะสำหรับอาการเหล่านั้น เช่น หากปวดหัวรุนแรง คลื่นไส้ อาเจียน แขนขาอ่อนแรง ให้แจ้งเตือนให้พบแพทย์ทันที\n"
             "ตอบเป็น JSON เช่น {{'summary': '...', 'recommendation': '...'}}"
         )
     )
 
+# template ของ AI3 และภาพผิวหนังวางคำสั่งที่คงที่ไว้ก่อน และข้อมูลของแต่ละคำขอไว้ท้ายสุด
+# เพื่อให้ prefix ของ prompt เหมือนกันทุกครั้ง (ใช้ prefix cache ฝั่ง LLM server ได้)
+@lru_cache(maxsize=None)
 def get_ai3_doctor_reply_template():
     return PromptTemplate(
         input_variables=["ai2_summary", "ai2_recommendation"],
         template=(
             "คุณเป็นหมอผู้หญิงไทยใจดี สุภาพ ให้คำปรึกษาเป็นกันเองแบบผู้เชี่ยวชาญ\n"
-            "ต่อไปนี้เป็นข้อมูลสรุปและข้อแนะนำเกี่ยวกับอาการของผู้ใช้:\n"
-            "สรุปสถานการณ์: {ai2_summary}\n"
-            "ข้อแนะนำ: {ai2_recommendation}\n"
-            "โปรดตอบผู้ใช้ด้วยสรรพนามว่า 'คุณ' เท่านั้น (ห้ามใช้ 'ลูกค้า', 'ท่าน', หรือสรรพนามอื่น)\n"
+            + PRONOUN_RULE +
             "**เริ่มต้นด้วยประโยคปลอบใจหรือให้กำลังใจสั้นๆ 1 ประโยค** "
             "จากนั้นให้สรุปแนวทางดูแลตัวเองและข้อควรระวังเป็น bullet point (•) พร้อมอิโมจิที่เหมาะสม เช่น 💧 🥗 😴 ⚠️\n"
             "**ห้ามพูดเกริ่นนำ เช่น 'เข้าใจเลยค่ะว่า...' หรือ 'ดิฉันเข้าใจว่า...' หรือประโยคที่ยืดเยื้อ ให้เริ่ม bullet point ได้เลยหลังประโยคปลอบใจ**\n"
             "คำตอบควรอ่านง่าย กระชับ ชัดเจน และเป็นมืออาชีพ\n"
             "อย่าแนะนำยา อย่าวินิจฉัยโรค และให้ย้ำหากควรไปพบแพทย์\n"
             "คำแนะนำนี้จะรวมถึงข้อมูลโรคที่คาดการณ์เช่น 'โรคที่มีความน่าจะเป็นสูงสุดจากข้อมูลของคุณคือ ไข้หวัดใหญ่'\n"
-            "ตอบเป็นข้อความเดียว (ไม่ต้องตอบเป็น JSON)"
+            "ตอบเป็นข้อความเดียว (ไม่ต้องตอบเป็น JSON)\n\n"
+            "ต่อไปนี้เป็นข้อมูลสรุปและข้อแนะนำเกี่ยวกับอาการของผู้ใช้:\n"
+            "สรุปสถานการณ์: {ai2_summary}\n"
+            "ข้อแนะนำ: {ai2_recommendation}"
         )
     )
 
 
+@lru_cache(maxsize=None)
 def get_skin_image_summary_template():
     return PromptTemplate(
         input_variables=["image_class", "ai2_summary", "ai2_recommendation"],
         template=(
             "คุณเป็นหมอผู้หญิงไทยใจดี สุภาพ ให้คำปรึกษาอย่างมืออาชีพและเป็นกันเอง\n"
-            "ระบบ AI ได้วิเคราะห์ภาพถ่ายผิวหนังที่ผู้ใช้อัปโหลด และจัดอยู่ในกลุ่ม: {image_class}\n"
-            "สรุปสถานการณ์: {ai2_summary}\n"
-            "ข้อแนะนำ: {ai2_recommendation}\n\n"
             "หาก image_class เป็น 'Abnormal(Ulcer)' ให้คุณ:\n"
             "- กล่าวถึงความเสี่ยงว่า *อาจเกี่ยวข้องกับเบาหวานหรือโรคผิวหนังจากน้ำตาลในเลือดสูง*\n"
             "- ให้คำแนะนำการดูแลรักษาเบื้องต้น เช่น การล้างแผล การปิดแผล การพักผ่อน การหลีกเลี่ยงแสงแดด\n"
@@ -72,6 +82,9 @@ def get_skin_image_summary_template():
             "**จากนั้นให้คำแนะนำเป็น bullet point (•) พร้อมอิโมจิ** เช่น 💧 🩹 😴 🛡️ ⚠️\n"
             "**อย่าเกริ่นว่า 'จากภาพ...', 'ดิฉันวิเคราะห์ได้ว่า...' หรือประโยคอ้างอิงตัวเอง**\n"
             "คำตอบควรเข้าใจง่าย กระชับ และมีความรับผิดชอบ\n"
-            "คำตอบควรเป็นข้อความเดียว (ไม่ต้องเป็น JSON)"
+            "คำตอบควรเป็นข้อความเดียว (ไม่ต้องเป็น JSON)\n\n"
+            "ระบบ AI ได้วิเคราะห์ภาพถ่ายผิวหนังที่ผู้ใช้อัปโหลด และจัดอยู่ในกลุ่ม: {image_class}\n"
+            "สรุปสถานการณ์: {ai2_summary}\n"
+            "ข้อแนะนำ: {ai2_recommendation}"
         )
     )
\ No newline at end of file
@@ -1,10 +1,14 @@
 # predict.py
+import heapq
+import re
+from functools import lru_cache
+import numpy as np
 import pandas as pd
-from rapidfuzz import process
-from collections import defaultdict
+from rapidfuzz import fuzz, process
 
 def load_symptom_data(csv_path):
-    df = pd.read_csv(csv_path, encoding='utf-8-sig')
+    # ไม่อ่านคอลัมน์ index ที่ติดมากับไฟล์ (Unnamed: ...) ตั้งแต่ตอน parse
+    df = pd.read_csv(csv_path, encoding='utf-8-sig', usecols=lambda col: not col.startswith("Unnamed"))
     # ค้นหาคอลัมน์โรคที่แท้จริง
     disease_col = None
     for d in ["diagnosis", "disease", "โรค"]:
@@ -14,34 +18,81 @@ def load_symptom_data(csv_path):
     if disease_col is None:
         raise ValueError("ไม่พบคอลัมน์ diagnosis/disease/โรค ในไฟล์ CSV")
     # อาการทั้งหมดคือทุกคอลัมน์ที่ไม่ใช่โรค
-    known_symptoms = [col for col in df.columns if col != disease_col and not col.startswith("Unnamed")]
+    known_symptoms = tuple(col for col in df.columns if col != disease_col)
+    # คอลัมน์อาการแบบ one-hot เป็นจำนวนเต็ม 0/1 ลดขนาดจาก int64 เป็นชนิดที่เล็กที่สุดที่พอ (ปกติคือ int8)
+    int_cols = [col for col in known_symptoms if pd.api.types.is_integer_dtype(df[col])]
+    if int_cols:
+        df[int_cols] = df[int_cols].apply(pd.to_numeric, downcast="integer")
     return df, known_symptoms, disease_col
 
+# ตัวแบ่งคำ: "และ", จุลภาค หรือช่องว่าง — แยกคำได้ในการสแกนครั้งเดียว
+WORD_SPLIT_PATTERN = re.compile(r"และ|,|\s+")
+
+# ตารางชื่อเรียกอื่นของอาการ -> ชื่ออาการในข้อมูล สร้างครั้งเดียวต่อรายการอาการ (known_symptoms เป็น tuple จึงใช้เป็น key ได้)
+# ครอบคลุมชื่อตรงตัว ตัวพิมพ์เล็ก และแบบใช้ '-' แทน '_' ชื่อที่ชนกันให้อาการที่มาก่อนในข้อมูล
+@lru_cache(maxsize=8)
+def _symptom_alias_table(known_symptoms):
+    table = {symptom: symptom for symptom in known_symptoms}
+    for symptom in known_symptoms:
+        lower = symptom.lower()
+        table.setdefault(lower, symptom)
+        table.setdefault(lower.replace("_", "-"), symptom)
+    return table
+
+def _lookup_symptom_alias(word, alias_table):
+    canonical = alias_table.get(word)
+    return canonical if canonical is not None else alias_table.get(word.lower())
+
 def extract_symptoms_from_text(user_text, known_symptoms, threshold=80):
-    words = user_text.replace('และ', ' ').replace(',', ' ').split()
-    matched = set()
-    for word in words:
-        res = process.extractOne(word, known_symptoms, score_cutoff=threshold)
-        if res is not None:
-            match = res[0]
-            matched.add(match)
-    return list(matched)
-
-def predict_disease_percent(symptom_list, df, disease_col):
-    summary = defaultdict(lambda: {"total_match": 0, "case_count": 0, "max_symptom": 0})
-    for _, row in df.iterrows():
-        disease = row[disease_col]
-        matched = sum([row[symptom] for symptom in symptom_list if symptom in df.columns])
-        max_total = len(symptom_list)
-        if max_total > 0:
-            summary[disease]["total_match"] += matched / max_total
-            summary[disease]["case_count"] += 1
-            summary[disease]["max_symptom"] = max_total
-    results = []
-    for disease, stats in summary.items():
-        avg_percent = round((stats["total_match"] / stats["case_count"]) * 100, 2) if stats["case_count"] > 0 else 0.0
-        results.append((disease, avg_percent, stats["max_symptom"]))
-    # เรียงจากโรคที่ตรงกับอาการมากที่สุด
+    words = [word for word in WORD_SPLIT_PATTERN.split(user_text) if word]
+    alias_table = _symptom_alias_table(tuple(known_symptoms))
+    exact = {word: _lookup_symptom_alias(word, alias_table) for word in words}
+    # คำที่ตรงกับชื่ออาการ (หรือชื่อเรียกอื่นในตาราง) หาได้ด้วย dict ทันที ที่เหลือค่อย fuzzy match
+    fuzzy_words = [word for word, canonical in exact.items() if canonical is None]
+    fuzzy_matches = {}
+    if fuzzy_words and known_symptoms:
+        # ให้คะแนนทุกคำกับทุกอาการในการเรียก cdist ครั้งเดียว (scorer เดียวกับ extractOne)
+        # แล้วเลือกอาการที่คะแนนสูงสุดของแต่ละคำ (argmax คืนตัวแรกเมื่อคะแนนเท่ากัน เหมือน extractOne)
+        scores = process.cdist(fuzzy_words, known_symptoms, scorer=fuzz.WRatio, score_cutoff=threshold)
+        best = scores.argmax(axis=1)
+        for word, row, idx in zip(fuzzy_words, scores, best):
+            if row[idx] >= threshold:
+                fuzzy_matches[word] = known_symptoms[idx]
+    matched = (exact[word] or fuzzy_matches.get(word) for word in words)
+    # ตัดอาการซ้ำโดยคงลำดับตามข้อความผู้ใช้ (list(set(...)) ได้ลำดับไม่แน่นอน)
+    return list(dict.fromkeys(match for match in matched if match is not None))
+
+def build_disease_profiles(df, disease_col, known_symptoms):
+    # ค่าเฉลี่ยของแต่ละอาการต่อโรค (เรียงโรคตามลำดับในข้อมูล) คำนวณครั้งเดียวตอนโหลดข้อมูล
+    # ค่าเฉลี่ยของผลรวมอาการ = ผลรวมของค่าเฉลี่ยแต่ละอาการ ตอนทำนายจึงไม่ต้องแตะทุกแถวของ df อีก
+    # เก็บเป็น (ชื่อโรค, ตำแหน่งคอลัมน์ของแต่ละอาการ, ndarray) เพื่อตัดคอลัมน์ด้วย numpy ตรงๆ ไม่ผ่าน index ของ pandas
+    means = df.groupby(disease_col, sort=False)[list(known_symptoms)].mean()
+    symptom_index = {symptom: i for i, symptom in enumerate(means.columns)}
+    return tuple(means.index), symptom_index, means.to_numpy()
+
+def predict_disease_percent(symptom_list, df, disease_col, top_n=None, profiles=None):
+    max_total = len(symptom_list)
+    if max_total == 0:
+        return []
+    if profiles is not None:
+        # ใช้ค่าเฉลี่ยต่อโรคที่คำนวณไว้แล้วจาก build_disease_profiles
+        diseases, symptom_index, means = profiles
+        cols = [symptom_index[symptom] for symptom in symptom_list if symptom in symptom_index]
+        scored = zip(diseases, means[:, cols].sum(axis=1) / max_total)
+    else:
+        # รวมค่าอาการที่ตรงของทุกแถวในคำสั่ง numpy เดียว แล้วหาค่าเฉลี่ยต่อโรคด้วย groupby (คงลำดับโรคตามข้อมูล)
+        # แทนการวน iterrows ทีละแถว
+        symptom_cols = [symptom for symptom in symptom_list if symptom in df.columns]
+        matched = df[symptom_cols].to_numpy().sum(axis=1) if symptom_cols else np.zeros(len(df))
+        match_ratio = pd.Series(matched / max_total, index=df.index)
+        scored = match_ratio.groupby(df[disease_col], sort=False).mean().items()
+    results = (
+        (disease, round(float(ratio) * 100, 2), max_total)
+        for disease, ratio in scored
+    )
+    # เรียงจากโรคที่ตรงกับอาการมากที่สุด (ถ้าระบุ top_n เลือกเฉพาะ N อันดับแรกโดยไม่ต้องเรียงทั้งหมด)
+    if top_n is not None:
+        return heapq.nlargest(top_n, results, key=lambda x: x[1])
     return sorted(results, key=lambda x: x[1], reverse=True)
 
 if __name__ == "__main__":
@@ -50,7 +101,7 @@ if __name__ == "__main__":
     user_text = input("โปรดพิมพ์อาการของคุณเป็นประโยค: ")
     matched_symptoms = extract_symptoms_from_text(user_text, known_symptoms)
     print("\nอาการที่ระบบเข้าใจ:", matched_symptoms)
-    results = predict_disease_percent(matched_symptoms, df, disease_col)
+    results = predict_disease_percent(matched_symptoms, df, disease_col, top_n=5)
     print("\nระบบวิเคราะห์ว่าอาจเป็นโรคต่อไปนี้:")
-    for i, (disease, percent, max_symptom) in enumerate(results[:5]):
+    for i, (disease, percent, max_symptom) in enumerate(results):
         print(f"{i+1}. {disease}: {percent}% (จากอาการทั้งหมด {max_symptom})")
\ No newline at end of file
@@ -1,61 +1,242 @@
-from keras.models import load_model
+import hashlib
+import os
+import threading
+from collections import OrderedDict
 import numpy as np
 from PIL import Image
 import streamlit as st
 
 MODEL_PATH = './custom_cnn_dfu_model.h5'
+TFLITE_MODEL_PATH = './custom_cnn_dfu_model.tflite'
 CLASS_NAMES = ['Abnormal(Ulcer)', 'Normal(Healthy skin)']
+ABNORMAL_CLASS, NORMAL_CLASS = CLASS_NAMES
 IMAGE_SIZE = (224, 224)
+# ไลบรารี GPU delegate ของ TFLite (ถ้าโหลดไม่ได้จะรันบน CPU แทน)
+TFLITE_GPU_DELEGATE = os.getenv("TFLITE_GPU_DELEGATE", "libtensorflowlite_gpu_delegate.so")
+# จำนวน thread ที่โมเดลใช้บน CPU ทั้ง TFLite และ TensorFlow (ไม่กำหนด = ใช้ค่าเริ่มต้นของ runtime)
+SKIN_MODEL_THREADS = int(os.getenv("SKIN_MODEL_THREADS", "0")) or None
+# เปิด XLA JIT ให้โมเดล Keras (.h5) ด้วย SKIN_MODEL_XLA=1 (compile ครั้งแรกช้ากว่า แต่รันครั้งต่อไปเร็วขึ้น)
+SKIN_MODEL_XLA = os.getenv("SKIN_MODEL_XLA") == "1"
+# เริ่มโหลดโมเดลเบื้องหลังตั้งแต่เปิดแอปด้วย SKIN_MODEL_PRELOAD=1 (ค่าเริ่มต้นปิด ให้แชทอย่างเดียวไม่ต้อง import TensorFlow)
+SKIN_MODEL_PRELOAD = os.getenv("SKIN_MODEL_PRELOAD") == "1"
+
+
+class _TFLiteModel:
+    """ห่อ TFLite Interpreter ให้เรียก predict_on_batch(batch) ได้แบบเดียวกับโมเดล Keras"""
+
+    def __init__(self, model_path):
+        # ใช้ tflite_runtime (แพ็กเกจเล็ก import เร็ว) ถ้ามี ไม่มีค่อยใช้ Interpreter จาก TensorFlow เต็มชุด
+        try:
+            from tflite_runtime.interpreter import Interpreter, load_delegate
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+            load_delegate = tf.lite.experimental.load_delegate
+
+        try:
+            # ลองใช้ GPU delegate ก่อน (โมเดล fp16 รันบน GPU ได้เร็วกว่า) โหลดไม่ได้หรือโมเดลไม่รองรับก็ใช้ CPU
+            self._interpreter = Interpreter(model_path=model_path,
+                                            experimental_delegates=[load_delegate(TFLITE_GPU_DELEGATE)],
+                                            num_threads=SKIN_MODEL_THREADS)
+            self._interpreter.allocate_tensors()
+        except (ValueError, OSError, RuntimeError):
+            # CPU ใช้ kernel ของ XNNPACK ซึ่ง TFLite เปิดเป็นค่าเริ่มต้นอยู่แล้ว กำหนดแค่จำนวน thread (ถ้าตั้ง SKIN_MODEL_THREADS ไว้)
+            self._interpreter = Interpreter(model_path=model_path, num_threads=SKIN_MODEL_THREADS)
+            self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._lock = threading.Lock()
+
+    def _quantize_input(self, img_array):
+        # โมเดลแบบ integer (int8/uint8) รับภาพที่ quantize ตาม scale/zero-point ของ input โดยตรง
+        # จึงแปลงภาพ 0-1 เป็นจำนวนเต็มเองก่อนส่ง ไม่ต้องมี float ใน input ของ interpreter
+        dtype = self._input["dtype"]
+        if not np.issubdtype(dtype, np.integer):
+            return img_array.astype(dtype, copy=False)
+        scale, zero_point = self._input["quantization"]
+        info = np.iinfo(dtype)
+        return np.clip(np.round(img_array / scale + zero_point), info.min, info.max).astype(dtype)
+
+    def _dequantize_output(self, output):
+        if not np.issubdtype(output.dtype, np.integer):
+            return output
+        scale, zero_point = self._output["quantization"]
+        return (output.astype(np.float32) - zero_point) * scale
+
+    def predict_on_batch(self, batch):
+        # interpreter ใช้ร่วมกันทุก session ของ Streamlit จึงต้องล็อกไม่ให้ set_tensor/invoke ซ้อนกัน
+        with self._lock:
+            # ปรับ batch ของ input ให้เท่าจำนวนภาพแล้ว invoke ครั้งเดียวทั้ง batch
+            # (จัดสรร tensor ใหม่เฉพาะตอนที่จำนวนภาพเปลี่ยน)
+            if self._input["shape"][0] != len(batch):
+                self._interpreter.resize_tensor_input(self._input["index"], [len(batch), *self._input["shape"][1:]])
+                self._interpreter.allocate_tensors()
+                self._input = self._interpreter.get_input_details()[0]
+                self._output = self._interpreter.get_output_details()[0]
+            self._interpreter.set_tensor(self._input["index"], self._quantize_input(batch))
+            self._interpreter.invoke()
+            return self._dequantize_output(self._interpreter.get_tensor(self._output["index"]))
+
+
+# ข้อความ error ของการโหลดโมเดลครั้งล่าสุด ให้ predict_skin_diseases แจ้งผู้ใช้ได้
+# แม้การโหลดจะเกิดใน thread ของ preload_skin_model ซึ่งแสดง st.error บนหน้าเว็บไม่ได้
+_model_load_error = None
+
 
 @st.cache_resource
 def load_skin_model():
-    """โหลดโมเดล AI สำหรับวิเคราะห์ผิวหนัง"""
+    """โหลดโมเดล AI สำหรับวิเคราะห์ผิวหนัง (ใช้ไฟล์ .tflite ถ้ามี ไม่มีก็ใช้ .h5)"""
+    global _model_load_error
     try:
-        # ✅ แก้ไขตรงนี้: ไม่ compile โมเดลเพื่อลด warning
-        model = load_model(MODEL_PATH, compile=False)
+        # ไฟล์ .tflite ที่ export ไว้ (ดู export_tflite_model) รันได้เร็วกว่าและไม่ต้องสร้างกราฟ Keras ทั้งชุด
+        if os.path.exists(TFLITE_MODEL_PATH):
+            model = _TFLiteModel(TFLITE_MODEL_PATH)
+        else:
+            # import keras เมื่อจะโหลดโมเดลจริงเท่านั้น ไม่ให้การ import โมดูลนี้ดึง TensorFlow ทั้งชุด
+            import tensorflow as tf
+            from keras.models import load_model
+
+            # ตั้ง thread pool เฉพาะเมื่อกำหนด SKIN_MODEL_THREADS ไว้เอง ไม่งั้นใช้ค่าเริ่มต้นของ TensorFlow (ทุกคอร์)
+            if SKIN_MODEL_THREADS:
+                try:
+                    # ภาพเดียวต่อครั้ง: ให้ op เดียวใช้หลาย thread (intra) แต่ไม่ต้องรันหลาย op ขนานกันมาก (inter)
+                    tf.config.threading.set_intra_op_parallelism_threads(SKIN_MODEL_THREADS)
+                    tf.config.threading.set_inter_op_parallelism_threads(2)
+                except RuntimeError:
+                    # TensorFlow เริ่มทำงานไปแล้ว ตั้งค่า thread ได้ก่อนรัน op แรกเท่านั้น จึงใช้ค่าเดิม
+                    pass
+
+            # ✅ แก้ไขตรงนี้: ไม่ compile โมเดลเพื่อลด warning
+            model = load_model(MODEL_PATH, compile=False)
+            if SKIN_MODEL_XLA:
+                # compile เฉพาะ jit_compile (ไม่มี optimizer/loss) ให้ predict function รวม op เป็น kernel ของ XLA
+                model.compile(jit_compile=True)
+
+        # warm-up ด้วยภาพว่างตอนโหลด ให้การสร้างกราฟ/จัดสรรหน่วยความจำครั้งแรกเกิดใน preload_skin_model
+        # ไม่ไปตกที่การกดวิเคราะห์ภาพครั้งแรกของผู้ใช้
+        model.predict_on_batch(np.zeros((1, IMAGE_SIZE[1], IMAGE_SIZE[0], 3), dtype=np.float32))
         return model
     except Exception as e:
+        _model_load_error = str(e)
         st.error(f"ไม่สามารถโหลดโมเดลได้: {str(e)}")
         return None
 
-def predict_skin_disease(img_pil: Image.Image):
+@st.cache_resource
+def preload_skin_model():
+    """เริ่มโหลดโมเดล (รวม warm-up) ใน background thread ครั้งเดียวต่อ process เมื่อเปิด SKIN_MODEL_PRELOAD"""
+    if not SKIN_MODEL_PRELOAD:
+        return None
+    # ถ้าผู้ใช้กดวิเคราะห์ก่อนโหลดเสร็จ load_skin_model (cache_resource) จะรอผลจาก thread นี้ ไม่โหลดซ้ำ
+    thread = threading.Thread(target=load_skin_model, name="skin-model-preload", daemon=True)
+    thread.start()
+    return thread
+
+
+def _preprocess_image(img_pil: Image.Image, out: np.ndarray = None) -> np.ndarray:
+    """ปรับขนาดและ normalize ภาพให้อยู่ในรูป (H, W, 3) float32 ช่วง 0-1 (เขียนลง out ถ้าระบุ)"""
+    img = img_pil.resize(IMAGE_SIZE)
+    # รองรับ grayscale และ alpha channel: ให้ PIL แปลงภาพที่ย่อแล้วเป็น RGB (เฉพาะเมื่อไม่ใช่ RGB อยู่แล้ว)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    # หารพิกเซล uint8 ด้วย 255 แบบ float32 แล้วเขียนผลลง out โดยตรง ไม่สร้าง array ชั่วคราวเพิ่ม
+    if out is None:
+        out = np.empty((IMAGE_SIZE[1], IMAGE_SIZE[0], 3), dtype=np.float32)
+    np.divide(np.asarray(img), np.float32(255.0), out=out, dtype=np.float32)
+    return out
+
+
+# cache ผลทำนายตาม hash ของ input ที่ preprocess แล้ว (LRU จำกัดจำนวน) ใช้ร่วมกันทุก session จึงต้องมี lock
+_PREDICTION_CACHE_SIZE = 128
+_prediction_cache = OrderedDict()
+_prediction_cache_lock = threading.Lock()
+
+
+def _get_cached_prediction(key):
+    with _prediction_cache_lock:
+        result = _prediction_cache.get(key)
+        if result is not None:
+            _prediction_cache.move_to_end(key)
+        return result
+
+
+def _store_cached_prediction(key, result):
+    with _prediction_cache_lock:
+        _prediction_cache[key] = result
+        _prediction_cache.move_to_end(key)
+        if len(_prediction_cache) > _PREDICTION_CACHE_SIZE:
+            _prediction_cache.popitem(last=False)
+
+
+def predict_skin_diseases(images):
     """
-    วิเคราะห์โรคผิวหนังจากภาพ
+    วิเคราะห์โรคผิวหนังจากหลายภาพโดยเรียกโมเดลครั้งเดียวทั้ง batch
 
     Args:
-        img_pil (Image.Image): ภาพ PIL ที่ต้องการวิเคราะห์
+        images (List[Image.Image]): รายการภาพ PIL ที่ต้องการวิเคราะห์
 
     Returns:
-        Tuple[str, float]: (predicted_class, confidence)
+        List[Tuple[str, float]]: [(predicted_class, confidence), ...] เรียงตามลำดับภาพ
     """
+    if not images:
+        return []
+
     model = load_skin_model()
 
     if model is None:
-        raise Exception("ไม่สามารถโหลดโมเดลได้")
+        raise Exception(f"ไม่สามารถโหลดโมเดลได้: {_model_load_error}")
 
     try:
-        # ปรับขนาดและ normalize
-        img = img_pil.resize(IMAGE_SIZE)
-        img_array = np.array(img).astype('float32') / 255.0
+        # จอง batch (N, H, W, 3) ครั้งเดียว แล้วให้แต่ละภาพเขียนลงช่องของตัวเอง ไม่ต้อง np.stack คัดลอกซ้ำ
+        batch = np.empty((len(images), IMAGE_SIZE[1], IMAGE_SIZE[0], 3), dtype=np.float32)
+        for i, img in enumerate(images):
+            _preprocess_image(img, out=batch[i])
 
-        # รองรับ grayscale และ alpha channel
-        if img_array.ndim == 2:
-            img_array = np.stack([img_array]*3, axis=-1)
-        elif img_array.shape[2] == 4:
-            img_array = img_array[:, :, :3]
+        # ภาพที่ input ของโมเดลเหมือนเดิมทุกไบต์ (เช่น ผู้ใช้กดวิเคราะห์ภาพเดิมซ้ำ) ใช้ผลจาก cache ไม่ต้องรันโมเดล
+        keys = [hashlib.blake2b(img_array.tobytes(), digest_size=16).digest() for img_array in batch]
+        results = [_get_cached_prediction(key) for key in keys]
+        misses = [i for i, result in enumerate(results) if result is None]
+        if misses:
+            # ทำนาย: predict_on_batch รันทั้ง batch ในครั้งเดียว ไม่ผ่าน tf.data/callback/progress ของ predict()
+            predictions = model.predict_on_batch(batch if len(misses) == len(batch) else batch[misses])
+            # argmax ครั้งเดียวแล้วอ่านค่าที่ตำแหน่งนั้น ไม่ต้องสแกนหาค่าสูงสุดซ้ำด้วย np.max
+            class_indices = predictions.argmax(axis=1)
+            confidences = predictions[np.arange(len(misses)), class_indices].tolist()
+            class_indices = class_indices.tolist()
+            for i, class_idx, confidence in zip(misses, class_indices, confidences):
+                results[i] = (CLASS_NAMES[class_idx], confidence)
+                _store_cached_prediction(keys[i], results[i])
+        return results
 
-        # เพิ่มมิติ batch
-        img_array = np.expand_dims(img_array, axis=0)
+    except Exception as e:
+        raise Exception(f"เกิดข้อผิดพลาดในการวิเคราะห์ภาพ: {str(e)}")
 
-        # ทำนาย
-        prediction = model.predict(img_array, verbose=0)
-        predicted_class = CLASS_NAMES[np.argmax(prediction)]
-        confidence = float(np.max(prediction))
 
-        return predicted_class, confidence
+def predict_skin_disease(img_pil: Image.Image):
+    """
+    วิเคราะห์โรคผิวหนังจากภาพ
 
-    except Exception as e:
-        raise Exception(f"เกิดข้อผิดพลาดในการวิเคราะห์ภาพ: {str(e)}")
+    Args:
+        img_pil (Image.Image): ภาพ PIL ที่ต้องการวิเคราะห์
+
+    Returns:
+        Tuple[str, float]: (predicted_class, confidence)
+    """
+    return predict_skin_diseases([img_pil])[0]
+
+
+# ข้อความคงที่ของแต่ละคลาส (ข้อสรุป, คำแนะนำ) ตอนเรียกเติมเฉพาะความมั่นใจ
+_CONDITION_DESCRIPTION_TEXT = {
+    ABNORMAL_CLASS: (
+        "🔍 ตรวจพบความผิดปกติที่อาจเป็นแผลเกิดจากโรคเบาหวาน ",
+        "📌 คำแนะนำ: ควรพบแพทย์เฉพาะทางหรือคลินิกโรคผิวหนังเพื่อวินิจฉัยเพิ่มเติมค่ะ",
+    ),
+    NORMAL_CLASS: (
+        "✅ ไม่พบความผิดปกติจากภาพที่วิเคราะห์ ",
+        "📌 อย่างไรก็ตาม หากยังมีอาการผิดปกติ ควรปรึกษาแพทย์เพื่อความแน่ใจนะคะ",
+    ),
+}
+_UNKNOWN_CONDITION_DESCRIPTION = "ไม่สามารถประเมินผลได้จากภาพนี้ค่ะ กรุณาลองใหม่หรือลองใช้ภาพอื่น"
 
 
 def get_skin_condition_description(predicted_class: str, confidence: float) -> str:
@@ -69,17 +250,63 @@ def get_skin_condition_description(predicted_class: str, confidence: float) -> s
     Returns:
         str: คำตอบสรุปที่เหมาะสำหรับแสดงในหน้าเว็บ
     """
-    if predicted_class == 'Abnormal(Ulcer)':
-        return (
-            f"🔍 ตรวจพบความผิดปกติที่อาจเป็นแผลเกิดจากโรคเบาหวาน "
-            f"(ความมั่นใจ {confidence*100:.2f}%)\n\n"
-            "📌 คำแนะนำ: ควรพบแพทย์เฉพาะทางหรือคลินิกโรคผิวหนังเพื่อวินิจฉัยเพิ่มเติมค่ะ"
-        )
-    elif predicted_class == 'Normal(Healthy skin)':
-        return (
-            f"✅ ไม่พบความผิดปกติจากภาพที่วิเคราะห์ "
-            f"(ความมั่นใจ {confidence*100:.2f}%)\n\n"
-            "📌 อย่างไรก็ตาม หากยังมีอาการผิดปกติ ควรปรึกษาแพทย์เพื่อความแน่ใจนะคะ"
-        )
-    else:
-        return "ไม่สามารถประเมินผลได้จากภาพนี้ค่ะ กรุณาลองใหม่หรือลองใช้ภาพอื่น"
\ No newline at end of file
+    texts = _CONDITION_DESCRIPTION_TEXT.get(predicted_class)
+    if texts is None:
+        return _UNKNOWN_CONDITION_DESCRIPTION
+    finding, advice = texts
+    return f"{finding}(ความมั่นใจ {confidence*100:.2f}%)\n\n{advice}"
+
+
+def export_tflite_model(output_path: str = TFLITE_MODEL_PATH, quantization: str = "fp16",
+                        representative_images=None) -> str:
+    """
+    แปลงโมเดล Keras (.h5) เป็น TFLite แบบ quantize เพื่อให้ inference เร็วขึ้น (รันครั้งเดียวแบบ offline)
+
+    Args:
+        output_path (str): ตำแหน่งไฟล์ .tflite ที่จะบันทึก
+        quantization (str): "fp32" (ไม่ quantize), "fp16", "dynamic" (น้ำหนักเป็น int8)
+            หรือ "int8" (quantize ทั้งโมเดลรวม input/output เป็น int8)
+        representative_images (List[str]): path ภาพตัวอย่างสำหรับ calibrate ช่วงค่า (จำเป็นเมื่อใช้ "int8")
+
+    Returns:
+        str: path ของไฟล์ .tflite ที่สร้างขึ้น
+    """
+    import tensorflow as tf
+    from keras.models import load_model
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(load_model(MODEL_PATH, compile=False))
+    if quantization == "fp16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "dynamic":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    elif quantization == "int8":
+        if not representative_images:
+            raise ValueError("quantization แบบ 'int8' ต้องระบุภาพตัวอย่างสำหรับ calibrate")
+
+        def representative_dataset():
+            # ผ่าน preprocessing เดียวกับตอนทำนาย ให้ช่วงค่าที่ calibrate ตรงกับ input จริง
+            for path in representative_images:
+                with Image.open(path) as img:
+                    yield [_preprocess_image(img)[np.newaxis]]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+    elif quantization != "fp32":
+        raise ValueError(f"ไม่รองรับ quantization แบบ '{quantization}'")
+
+    with open(output_path, "wb") as f:
+        f.write(converter.convert())
+    return output_path
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python skin_model_predict.py [fp32|fp16|dynamic|int8] [ภาพตัวอย่าง ...]
+    quantization = sys.argv[1] if len(sys.argv) > 1 else "fp16"
+    saved_path = export_tflite_model(quantization=quantization, representative_images=sys.argv[2:])
+    print("บันทึกโมเดล TFLite ที่:", saved_path)